@@ -0,0 +1,279 @@
+import sys
+import time
+
+import pytest
+
+
+lt = pytest.importorskip("libtorrent")
+torentino = pytest.importorskip("torentino")
+
+
+class RecordingNotifier(torentino.Notifier):
+    def __init__(self):
+        self.events = []
+
+    def on_start(self, name, torrent_path, save_path, port_start, port_end, total_mb):
+        self.events.append("start")
+        self.total_mb = total_mb
+
+    def on_progress(self, stats):
+        self.stats = stats
+
+    def on_complete(self, elapsed, average_speed_kb, files):
+        self.events.append("complete")
+
+    def on_no_peers_timeout(self, timeout):
+        self.events.append("no_peers_timeout")
+
+    def on_error(self, exc):
+        self.events.append("error")
+        self.exc = exc
+
+
+def make_torrent(tmp_path):
+    data_dir = tmp_path / "dl" / "d"
+    data_dir.mkdir(parents=True)
+    (data_dir / "x.bin").write_bytes(b"x" * 300000)
+    (data_dir / "y.bin").write_bytes(b"y" * 200000)
+    fs = lt.file_storage()
+    lt.add_files(fs, str(data_dir))
+    t = lt.create_torrent(fs)
+    lt.set_piece_hashes(t, str(tmp_path / "dl"))
+    torrent_path = tmp_path / "d.torrent"
+    torrent_path.write_bytes(lt.bencode(t.generate()))
+    return torrent_path
+
+
+def run_args(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["torentino.py", *argv])
+    return torentino.parse_args()
+
+
+def test_run_completes_on_local_torrent(tmp_path, monkeypatch):
+    torrent_path = make_torrent(tmp_path)
+    args = run_args(
+        monkeypatch,
+        "--torrent", str(torrent_path),
+        "--save-dir", str(tmp_path / "dl"),
+        "--port-start", "46881",
+        "--port-end", "46891",
+    )
+    notifier = RecordingNotifier()
+
+    torentino.run(args, notifier)
+
+    assert notifier.events == ["start", "complete"]
+    # Размер без pad-файлов: только x.bin и y.bin
+    assert notifier.total_mb * 1024 * 1024 == pytest.approx(500000)
+    assert notifier.stats["done"] == pytest.approx(notifier.stats["total"])
+
+
+def test_run_stops_on_no_peers_timeout(tmp_path, monkeypatch):
+    torrent_path = make_torrent(tmp_path)
+    args = run_args(
+        monkeypatch,
+        "--torrent", str(torrent_path),
+        "--save-dir", str(tmp_path / "empty"),
+        "--port-start", "46881",
+        "--port-end", "46891",
+        "--no-peers-timeout", "2",
+    )
+    notifier = RecordingNotifier()
+
+    started = time.monotonic()
+    with pytest.raises(SystemExit) as exc_info:
+        torentino.run(args, notifier)
+
+    assert exc_info.value.code == 5
+    assert notifier.events == ["start", "no_peers_timeout"]
+    assert time.monotonic() - started < 4
+
+
+def test_run_reports_corrupt_torrent(tmp_path, monkeypatch):
+    torrent_path = tmp_path / "bad.torrent"
+    torrent_path.write_bytes(b"garbage")
+    args = run_args(
+        monkeypatch,
+        "--torrent", str(torrent_path),
+        "--save-dir", str(tmp_path / "dl"),
+    )
+    notifier = RecordingNotifier()
+    monkeypatch.setattr(torentino, "create_session", None)
+
+    with pytest.raises(SystemExit) as exc_info:
+        torentino.run(args, notifier)
+
+    assert exc_info.value.code == 2
+    assert notifier.events == ["error"]
+
+
+@pytest.mark.skipif(
+    hasattr(lt, "posix_disk_io_constructor") or not hasattr(lt, "mmap_write_mode_t"),
+    reason="нужна сборка libtorrent 2.x без выбора disk_io_constructor",
+)
+@pytest.mark.parametrize("profile", sorted(torentino.SETTINGS_PROFILES))
+def test_posix_disk_io_falls_back_to_pwrite(profile):
+    settings = torentino.build_settings(profile, 46881, 46891)
+
+    ses = torentino.create_session(settings, "posix")
+
+    assert ses.get_settings()["disk_write_mode"] == int(lt.mmap_write_mode_t.always_pwrite)
+
+
+def test_torrent_files_skips_pad_files(tmp_path):
+    torrent_path = make_torrent(tmp_path)
+    info = lt.torrent_info(str(torrent_path))
+    save_path = str(tmp_path / "dl")
+
+    assert sorted(torentino.torrent_files(info, save_path)) == [
+        str(tmp_path / "dl" / "d" / "x.bin"),
+        str(tmp_path / "dl" / "d" / "y.bin"),
+    ]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(torentino.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    messages = []
+    monkeypatch.setattr(torentino, "send_telegram", messages.append)
+    return messages
+
+
+def progress_stats(progress, speed=100.0):
+    return {
+        "progress": progress,
+        "done": 1.0,
+        "total": 10.0,
+        "speed": speed,
+        "eta": "1м",
+        "peers": 3,
+    }
+
+
+def started_notifier(sent):
+    notifier = torentino.TelegramNotifier()
+    notifier.on_start("t", "t.torrent", "/dl", 6881, 6891, 10.0)
+    sent.clear()
+    return notifier
+
+
+def test_telegram_progress_step_is_deferred_until_min_interval(clock, sent):
+    notifier = started_notifier(sent)
+
+    clock[0] += 10
+    notifier.on_progress(progress_stats(25))
+    assert sent == []
+
+    clock[0] += 25
+    notifier.on_progress(progress_stats(30))
+    assert len(sent) == 1
+    assert "<b>30%</b>" in sent[0]
+
+    clock[0] += 30
+    notifier.on_progress(progress_stats(35))
+    assert len(sent) == 1
+
+
+def test_telegram_progress_step_needs_download_speed(clock, sent):
+    notifier = started_notifier(sent)
+
+    clock[0] += 60
+    notifier.on_progress(progress_stats(45, speed=0))
+    assert sent == []
+
+
+def test_telegram_progress_heartbeat(clock, sent):
+    notifier = started_notifier(sent)
+
+    clock[0] += 599
+    notifier.on_progress(progress_stats(5, speed=0))
+    assert sent == []
+
+    clock[0] += 1
+    notifier.on_progress(progress_stats(5, speed=0))
+    assert len(sent) == 1
+    assert "<b>5%</b>" in sent[0]
+
+    clock[0] += 600
+    notifier.on_progress(progress_stats(100))
+    assert len(sent) == 1
+
+
+def test_telegram_peer_messages_are_throttled_separately(clock, sent):
+    notifier = started_notifier(sent)
+
+    notifier.on_no_peers(300)
+    notifier.on_peers_back(5, progress_stats(10))
+    clock[0] += 10
+    notifier.on_no_peers(300)
+    notifier.on_peers_back(5, progress_stats(10))
+    assert len(sent) == 2
+    assert sent[0].startswith("⚠️")
+    assert sent[1].startswith("✅")
+
+    clock[0] += 50
+    notifier.on_no_peers(300)
+    notifier.on_peers_back(5, progress_stats(10))
+    assert len(sent) == 4
+
+
+def test_telegram_no_peers_timeout_is_not_throttled(clock, sent):
+    notifier = started_notifier(sent)
+
+    notifier.on_no_peers(300)
+    notifier.on_no_peers_timeout(300)
+    assert len(sent) == 2
+
+
+def run_tg_worker(monkeypatch, items):
+    tg_queue = torentino.queue.Queue()
+    for item in items:
+        tg_queue.put(item)
+    posted = []
+    monkeypatch.setattr(torentino, "tg_queue", tg_queue)
+    monkeypatch.setattr(torentino, "_post_telegram", lambda *args: posted.append(args))
+
+    worker = torentino.threading.Thread(target=torentino._tg_worker, daemon=True)
+    worker.start()
+    worker.join(timeout=5)
+
+    assert not worker.is_alive()
+    assert tg_queue.empty()
+    return posted
+
+
+def test_tg_worker_batches_by_destination_and_length(monkeypatch):
+    long_a = "x" * 3000
+    long_b = "y" * 2000
+    posted = run_tg_worker(monkeypatch, [
+        ("a", "token", "1"),
+        ("b", "token", "1"),
+        ("c", "token", "2"),
+        (long_a, "token", "2"),
+        (long_b, "token", "2"),
+        ("d", "other", "2"),
+        None,
+    ])
+
+    assert posted == [
+        ("a\n\nb", "token", "1"),
+        ("c\n\n" + long_a, "token", "2"),
+        (long_b, "token", "2"),
+        ("d", "other", "2"),
+    ]
+
+
+def test_tg_worker_limits_batch_size(monkeypatch):
+    items = [(str(i), "token", "1") for i in range(12)]
+    posted = run_tg_worker(monkeypatch, items + [None])
+
+    assert [message for message, _, _ in posted] == [
+        "\n\n".join(str(i) for i in range(10)),
+        "10\n\n11",
+    ]
@@ -1,10 +1,15 @@
 import argparse
+import atexit
 import logging
+import math
 import os
+import queue
 import sys
+import threading
 import time
 import requests
 import traceback
+from requests.adapters import HTTPAdapter
 
 try:
     import libtorrent as lt
@@ -16,10 +21,94 @@ except ImportError:
 
 from dotenv import load_dotenv
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Минимальный интервал между запросами статуса торрента при активности (сек)
+STATUS_UPDATE_INTERVAL = 1
+# Принудительный запрос статуса, если алертов не было дольше (сек)
+STATUS_HEARTBEAT = 5
+# Категории алертов, на которых построен основной цикл
+ALERT_MASK = (
+    lt.alert.category_t.error_notification
+    | lt.alert.category_t.status_notification
+    | lt.alert.category_t.connect_notification
+    | lt.alert.category_t.piece_progress_notification
+)
+
+# Строка прогресса в консоли (перерисовывается через log_progress)
+PROGRESS_FORMAT = (
+    "Прогресс: {progress}% | "
+    "Скачано: {done:.2f}/{total:.2f} MB | "
+    "Скорость: {speed:.2f} KB/s | "
+    "ETA: {eta} | "
+    "Пиров: {peers}   "
+)
+
+# Базовые пресеты настроек libtorrent, выбираются через --profile
+SETTINGS_PROFILES = {
+    "desktop": lt.default_settings,
+    "seed": lt.high_performance_seed,
+    "minmem": lt.min_memory_usage,
+}
+# Тюнинг пропускной способности поверх пресетов desktop/seed
+# (потоки диска, пул файлов и лимит соединений подбирает _autotune_pack)
+PERFORMANCE_OVERLAY = {
+    "send_buffer_watermark": 12 * 1024 * 1024,
+    "send_buffer_watermark_factor": 150,
+    "send_buffer_low_watermark": 1 * 1024 * 1024,
+    "choking_algorithm": 0,
+    "seed_choking_algorithm": 1,
+}
+# Старший номер версии libtorrent: 1.x и 2.x по-разному работают с дисковым кэшем
+LT_MAJOR = int(lt.version.split(".")[0])
+# libtorrent 1.x: собственный кэш; cache_size (в блоках по 16 KiB) — 1/8 памяти,
+# не больше CACHE_SIZE_MAX_V1 (1.6 GiB)
+CACHE_SIZE_MAX_V1 = 102400
+CACHE_TUNING_V1 = {
+    "cache_size_volatile": 256,
+    "use_read_cache": True,
+    "suggest_mode": 1,  # settings_pack::suggest_read_cache
+    "coalesce_reads": True,
+    "coalesce_writes": True,
+}
+# libtorrent 2.x: кэшем служит page cache ОС, увеличиваем только очередь записи
+CACHE_TUNING_V2 = {
+    "max_queued_disk_bytes": 8 * 1024 * 1024,
+}
+# Бэкенды дискового ввода-вывода libtorrent 2.x, выбираются через --disk-io
+DISK_IO_CONSTRUCTORS = {
+    "mmap": "mmap_disk_io_constructor",
+    "posix": "posix_disk_io_constructor",
+    "default": "default_disk_io_constructor",
+}
+
+# Фоновая отправка уведомлений в Telegram
+TELEGRAM_REPORT_STEP = 20  # Каждые 20% отправляется уведомление, если есть скорость
+TELEGRAM_PROGRESS_MIN_INTERVAL = 30  # Не чаще одного сообщения о прогрессе (сек)
+TELEGRAM_PROGRESS_HEARTBEAT = 600  # Прогресс не реже, даже без пересечения шага (сек)
+TELEGRAM_PEERS_MIN_INTERVAL = 60  # Не чаще одного сообщения «нет пиров»/«пиры появились» (сек)
+TELEGRAM_BATCH_SIZE = 10
+TELEGRAM_BATCH_WINDOW = 0.5
+TELEGRAM_MAX_LENGTH = 4096
+TELEGRAM_STOP_TIMEOUT = 5
+
+tg_queue = queue.Queue()
+tg_session = None
+tg_thread = None
+
 
 def send_telegram(message, token=None, chat_id=None):
     """
-    Отправляет уведомление в Telegram-бот.
+    Ставит уведомление для Telegram-бота в очередь фоновой отправки.
     chat_id = user_id (без минуса) — сообщение себе в личку
     chat_id = id группы (с минусом) — в группу
     """
@@ -28,9 +117,64 @@ def send_telegram(message, token=None, chat_id=None):
     if not token or not chat_id:
         logging.warning("TELEGRAM_BOT_TOKEN или TELEGRAM_CHAT_ID не заданы — уведомление не отправлено.")
         return
+    tg_queue.put_nowait((message, token, chat_id))
+
+
+def start_telegram():
+    """
+    Запускает фоновый поток отправки уведомлений с общим пулом соединений.
+    При завершении процесса очередь дописывается (не дольше TELEGRAM_STOP_TIMEOUT).
+    """
+    global tg_session, tg_thread
+    tg_session = requests.Session()
+    tg_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    tg_thread = threading.Thread(target=_tg_worker, name="telegram", daemon=True)
+    tg_thread.start()
+    atexit.register(stop_telegram)
+
+
+def stop_telegram():
+    if tg_thread is None or not tg_thread.is_alive():
+        return
+    tg_queue.put(None)
+    tg_thread.join(timeout=TELEGRAM_STOP_TIMEOUT)
+
+
+def _tg_worker():
+    """
+    Забирает сообщения из очереди и склеивает те, что пришли в течение
+    TELEGRAM_BATCH_WINDOW, в один запрос (в пределах лимита длины Telegram).
+    """
+    while True:
+        item = tg_queue.get()
+        if item is None:
+            return
+        message, token, chat_id = item
+        stop = False
+        deadline = time.monotonic() + TELEGRAM_BATCH_WINDOW
+        for _ in range(TELEGRAM_BATCH_SIZE - 1):
+            try:
+                item = tg_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            if (item[1:] != (token, chat_id)
+                    or len(message) + 2 + len(item[0]) > TELEGRAM_MAX_LENGTH):
+                _post_telegram(message, token, chat_id)
+                message, token, chat_id = item
+                continue
+            message += "\n\n" + item[0]
+        _post_telegram(message, token, chat_id)
+        if stop:
+            return
+
+
+def _post_telegram(message, token, chat_id):
     url = f"https://api.telegram.org/bot{token}/sendMessage"
     try:
-        resp = requests.post(url, data={
+        resp = tg_session.post(url, data={
             "chat_id": chat_id,
             "text": message,
             "parse_mode": "HTML"
@@ -50,17 +194,60 @@ def parse_args():
     parser.add_argument("--port-start", type=int, help="Начальный порт (или LISTEN_PORT_START, по умолчанию 6881)", required=False)
     parser.add_argument("--port-end", type=int, help="Конечный порт (или LISTEN_PORT_END, по умолчанию 6891)", required=False)
     parser.add_argument("--no-peers-timeout", type=int, default=300, help="Таймаут в секундах при отсутствии пиров (по умолчанию 300 секунд / 5 минут)")
+    parser.add_argument("--profile", choices=sorted(SETTINGS_PROFILES), help="Профиль настроек libtorrent: desktop, seed или minmem (или SETTINGS_PROFILE, по умолчанию desktop)", required=False)
+    parser.add_argument(
+        "--disk-io", choices=sorted(DISK_IO_CONSTRUCTORS),
+        help="Дисковый ввод-вывод libtorrent 2.x (или DISK_IO; по умолчанию posix в Docker, иначе default). "
+             "mmap в 2.x может раздувать RSS до гигабайт и упираться в лимиты памяти контейнера; "
+             "posix (pread/pwrite) держит память ровной без потерь скорости раздачи",
+        required=False,
+    )
     parser.add_argument("--verbose", action="store_true", help="Включить подробный режим логирования (DEBUG)")
     parser.add_argument("--logfile", help="Путь к файлу лога (по умолчанию только консоль)", required=False)
     return parser.parse_args()
 
 
+class ProgressStreamHandler(logging.StreamHandler):
+    """
+    Консольный обработчик, понимающий строку прогресса (см. log_progress):
+    она перерисовывается через \\r, а следующая обычная запись начинается
+    с новой строки.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._in_progress = False
+
+    def emit(self, record):
+        if getattr(record, "progress", False):
+            try:
+                self.stream.write("\r" + record.getMessage())
+                self.flush()
+                self._in_progress = True
+            except Exception:
+                self.handleError(record)
+            return
+        if self._in_progress:
+            self.stream.write("\n")
+            self._in_progress = False
+        super().emit(record)
+
+
+def log_progress(message):
+    """
+    Выводит строку прогресса поверх предыдущей; в файл лога не попадает.
+    """
+    logging.info(message, extra={"progress": True})
+
+
 def setup_logging(verbose=False, logfile=None):
     log_level = logging.DEBUG if verbose else logging.INFO
     log_format = "[%(asctime)s] %(levelname)s: %(message)s"
-    handlers = [logging.StreamHandler(sys.stdout)]
+    handlers = [ProgressStreamHandler(sys.stdout)]
     if logfile:
-        handlers.append(logging.FileHandler(logfile, encoding="utf-8"))
+        file_handler = logging.FileHandler(logfile, encoding="utf-8")
+        file_handler.addFilter(lambda record: not getattr(record, "progress", False))
+        handlers.append(file_handler)
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
     if root_logger.hasHandlers():
@@ -70,55 +257,405 @@ def setup_logging(verbose=False, logfile=None):
         root_logger.addHandler(handler)
 
 
+def build_settings(profile, port_start, port_end):
+    """
+    Собирает полный settings_pack, передаваемый в сессию одним вызовом:
+    пресет профиля, тюнинг производительности (кроме minmem) и параметры сессии.
+    """
+    pack = SETTINGS_PROFILES[profile]()
+    if profile != "minmem":
+        memory = _total_memory()
+        pack.update(PERFORMANCE_OVERLAY)
+        pack.update(_cache_pack(memory))
+        pack.update(_autotune_pack(memory))
+    pack.update({
+        "listen_interfaces": f"0.0.0.0:{port_start}-{port_end}",
+        "alert_mask": int(ALERT_MASK),
+    })
+    return pack
+
+
+def _cache_pack(memory):
+    if LT_MAJOR < 2:
+        pack = dict(CACHE_TUNING_V1)
+        if memory:
+            pack["cache_size"] = min(CACHE_SIZE_MAX_V1, memory // 8 // (16 * 1024))
+        cache_mb = f"{pack['cache_size'] * 16 // 1024} MB" if memory else "по умолчанию"
+        logging.info(f"libtorrent {lt.version}: включён собственный дисковый кэш 1.x, размер {cache_mb}")
+        return pack
+    logging.info(
+        f"libtorrent {lt.version}: кэш на стороне ОС, "
+        "увеличена очередь записи (ввод-вывод задаётся --disk-io)"
+    )
+    return CACHE_TUNING_V2
+
+
+def _autotune_pack(memory):
+    """
+    Подбирает число потоков диска, размер пула файлов и лимит соединений
+    под доступные процессу CPU, лимит дескрипторов и память.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 1
+    nofile = 1024
+    if resource is not None:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            nofile = soft
+        else:
+            nofile = 65536
+
+    pack = {
+        "aio_threads": max(4, cpu_count),
+        "file_pool_size": min(500, nofile // 4),
+        "connections_limit": min(8000, nofile // 2),
+    }
+    if memory:
+        # checking_mem_usage задаётся в блоках по 16 KiB: 1/64 памяти, от 4 до 16 MiB
+        pack["checking_mem_usage"] = min(1024, max(256, memory // 64 // (16 * 1024)))
+    logging.info(
+        f"Автонастройка: CPU={cpu_count}, RLIMIT_NOFILE={nofile}, "
+        f"RAM={memory // (1024 * 1024) if memory else '?'} MB -> "
+        + ", ".join(f"{k}={v}" for k, v in pack.items())
+    )
+    return pack
+
+
+def _total_memory():
+    """
+    Объём доступной памяти в байтах с учётом лимита cgroup (Docker), либо None.
+    """
+    memory = None
+    if psutil is not None:
+        memory = psutil.virtual_memory().total
+    else:
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemTotal:"):
+                        memory = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    for limit_path in ("/sys/fs/cgroup/memory.max",
+                       "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit() and (memory is None or int(limit) < memory):
+            memory = int(limit)
+        break
+    return memory
+
+
+def create_session(settings, disk_io):
+    """
+    Создаёт сессию libtorrent с заданными настройками и бэкендом диска.
+    В libtorrent 1.x выбора нет: ввод-вывод всегда через pread/pwrite.
+    """
+    constructor = getattr(lt, DISK_IO_CONSTRUCTORS[disk_io], None)
+    if constructor is None or not hasattr(lt, "session_params"):
+        if disk_io == "posix" and hasattr(lt, "mmap_write_mode_t"):
+            # Без posix-бэкенда хотя бы запись переводим с mmap на pwrite
+            settings["disk_write_mode"] = int(lt.mmap_write_mode_t.always_pwrite)
+            logging.warning(
+                f"libtorrent {lt.version} не позволяет выбрать posix_disk_io_constructor: режим posix не применён, "
+                "включена только запись через pwrite (disk_write_mode=always_pwrite), чтение идёт через mmap"
+            )
+        elif disk_io == "posix" and LT_MAJOR >= 2:
+            logging.warning(
+                f"libtorrent {lt.version} не позволяет выбрать posix_disk_io_constructor: "
+                "режим posix не применён, используется бэкенд по умолчанию"
+            )
+        else:
+            # 1.x всегда пишет через pread/pwrite, а mmap в 2.x — и так бэкенд по умолчанию
+            logging.debug(f"Выбор дискового ввода-вывода недоступен в libtorrent {lt.version}")
+        return lt.session(settings)
+    params = lt.session_params()
+    params.settings = settings
+    params.disk_io_constructor = constructor
+    return lt.session(params)
+
+
+def torrent_files(info, save_path):
+    """
+    Возвращает пути скачанных файлов по метаданным торрента, без обхода диска.
+    """
+    fs = info.files()
+    if fs.num_files() == 0:
+        return [
+            os.path.join(root, file)
+            for root, dirs, files in os.walk(save_path)
+            for file in files
+        ]
+    # Pad-файлы (BEP 47) существуют только в метаданных, на диск не пишутся
+    return [
+        os.path.join(save_path, fs.file_path(i))
+        for i in range(fs.num_files())
+        if not fs.file_flags(i) & lt.file_storage.flag_pad_file
+    ]
+
+
+def _fmt_eta(seconds):
+    eta_seconds = int(seconds)
+    if eta_seconds > 3600:
+        return f"{eta_seconds // 3600}ч {(eta_seconds % 3600) // 60}м"
+    if eta_seconds > 60:
+        return f"{eta_seconds // 60}м {eta_seconds % 60}с"
+    return f"{eta_seconds}с"
+
+
 def find_torrent_file():
     search_dirs = ["torrents", "/app/torrents"]
     candidates = []
     for folder in search_dirs:
         if os.path.isdir(folder):
-            torrents = [
-                os.path.join(folder, f)
-                for f in os.listdir(folder)
-                if f.endswith(".torrent")
-            ]
-            candidates.extend(torrents)
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.endswith(".torrent") and entry.is_file():
+                        candidates.append((entry.stat().st_ctime, entry.path))
     if not candidates:
         return None
-    candidates.sort(key=lambda f: os.path.getctime(f), reverse=True)
-    return candidates[0]
+    candidates.sort(reverse=True)
+    return candidates[0][1]
+
+
+def _detect_name_getter():
+    """
+    Выбирает способ получить имя торрента, доступный в установленной сборке libtorrent.
+    """
+    if getattr(lt.torrent_handle, "torrent_file", None) is not None:
+        return lambda h: h.torrent_file().name()
+    if getattr(lt.torrent_handle, "get_torrent_info", None) is not None:
+        return lambda h: h.get_torrent_info().name()
+    return lambda h: h.status().name
+
+
+_get_name = _detect_name_getter()
 
 
 def get_torrent_name(h):
     try:
-        tf = h.torrent_file
-        if callable(tf):
-            tf = tf()
-        if hasattr(tf, 'name'):
-            name_attr = tf.name
-            if callable(name_attr):
-                return name_attr()
-            return name_attr
+        return _get_name(h) or "Безымянный торрент"
     except Exception:
+        return "Безымянный торрент"
+
+
+class Notifier:
+    """
+    Получатель событий загрузки. Методы по умолчанию ничего не делают —
+    наследники переопределяют только нужные.
+    stats — словарь полей PROGRESS_FORMAT для текущего состояния.
+    """
+
+    def on_start(self, name, torrent_path, save_path, port_start, port_end, total_mb):
         pass
-    try:
-        info = h.get_torrent_info()
-        if hasattr(info, 'name'):
-            name_attr = info.name
-            if callable(name_attr):
-                return name_attr()
-            return name_attr
-    except Exception:
+
+    def on_progress(self, stats):
         pass
-    return "Безымянный торрент"
 
+    def on_no_peers(self, timeout):
+        pass
 
-def main():
-    # === Настройка шага прогресса (в процентах) для Telegram ===
-    report_step = 20  # Каждые 20% отправляется уведомление, если есть скорость
+    def on_no_peers_timeout(self, timeout):
+        pass
 
-    load_dotenv()
-    args = parse_args()
-    setup_logging(verbose=args.verbose, logfile=args.logfile)
+    def on_peers_back(self, waited, stats):
+        pass
+
+    def on_interrupted(self):
+        pass
+
+    def on_complete(self, elapsed, average_speed_kb, files):
+        pass
+
+    def on_error(self, exc):
+        pass
+
+
+class CompositeNotifier(Notifier):
+    """
+    Рассылает каждое событие всем вложенным получателям по порядку.
+    """
+
+    def __init__(self, notifiers):
+        self.notifiers = list(notifiers)
+
+    def _broadcast(self, method, *args):
+        for notifier in self.notifiers:
+            getattr(notifier, method)(*args)
+
+    def on_start(self, *args):
+        self._broadcast("on_start", *args)
+
+    def on_progress(self, *args):
+        self._broadcast("on_progress", *args)
+
+    def on_no_peers(self, *args):
+        self._broadcast("on_no_peers", *args)
+
+    def on_no_peers_timeout(self, *args):
+        self._broadcast("on_no_peers_timeout", *args)
+
+    def on_peers_back(self, *args):
+        self._broadcast("on_peers_back", *args)
+
+    def on_interrupted(self):
+        self._broadcast("on_interrupted")
+
+    def on_complete(self, *args):
+        self._broadcast("on_complete", *args)
+
+    def on_error(self, *args):
+        self._broadcast("on_error", *args)
 
+
+class ConsoleNotifier(Notifier):
+    """
+    Строка прогресса в консоли.
+    """
+
+    def on_progress(self, stats):
+        log_progress(PROGRESS_FORMAT.format_map(stats))
+
+
+class LogNotifier(Notifier):
+    """
+    Ключевые события загрузки в лог.
+    """
+
+    def on_start(self, name, torrent_path, save_path, port_start, port_end, total_mb):
+        logging.info(f"Скачивание файла: {name}")
+
+    def on_no_peers(self, timeout):
+        logging.warning("Нет подключённых пиров. Запущен таймер автоостановки по отсутствию пиров.")
+
+    def on_no_peers_timeout(self, timeout):
+        logging.error(f"Пиров нет {timeout} секунд подряд. Загрузка прервана.")
+
+    def on_peers_back(self, waited, stats):
+        logging.info(f"Появились пиры спустя {waited} секунд ожидания. Сбрасываем таймер.")
+
+    def on_interrupted(self):
+        logging.warning("Операция скачивания прервана пользователем (Ctrl+C).")
+
+    def on_complete(self, elapsed, average_speed_kb, files):
+        logging.info("Скачивание завершено!")
+        logging.info(f"Средняя скорость за сессию: {average_speed_kb:.2f} KB/s")
+        for path in files:
+            logging.debug(f"Файл: {path}")
+        logging.info(f"Общее время скачивания: {elapsed:.1f} сек.")
+
+    def on_error(self, exc):
+        logging.error(f"{type(exc).__name__}: {exc}")
+        logging.error(traceback.format_exc())
+
+
+class TelegramNotifier(Notifier):
+    """
+    Уведомления в Telegram: старт, прогресс каждые report_step%, пиры, итог и ошибки.
+    Прогресс и сообщения о пирах ограничены по времени, а не только по шагу.
+    """
+
+    def __init__(self, report_step=TELEGRAM_REPORT_STEP):
+        self.report_step = report_step
+        self.name = "N/A"
+        self.last_reported_percent = 0
+        self.last_progress_ts = float("-inf")
+        self.last_no_peers_ts = float("-inf")
+        self.last_peers_back_ts = float("-inf")
+
+    def on_start(self, name, torrent_path, save_path, port_start, port_end, total_mb):
+        self.name = name
+        self.last_progress_ts = time.monotonic()
+        send_telegram("\n".join([
+            f"🧲 <b>Старт загрузки</b>",
+            f"<b>Имя:</b> {name}",
+            f"<b>Путь к .torrent:</b> <code>{torrent_path}</code>",
+            f"<b>Сохраняем в:</b> <code>{save_path}</code>",
+            f"<b>Порты:</b> {port_start}-{port_end}",
+            f"<b>Размер:</b> {total_mb:.2f} MB",
+            f"<b>libtorrent:</b> {lt.version}",
+        ]))
+
+    def on_progress(self, stats):
+        # Прогресс при пересечении report_step% (если есть скорость), но не чаще
+        # TELEGRAM_PROGRESS_MIN_INTERVAL; либо по heartbeat на долгих загрузках
+        progress = stats["progress"]
+        if progress == 100:
+            return
+        now = time.monotonic()
+        elapsed = now - self.last_progress_ts
+        step_crossed = progress // self.report_step > self.last_reported_percent // self.report_step
+        if ((step_crossed and stats["speed"] > 0 and elapsed >= TELEGRAM_PROGRESS_MIN_INTERVAL)
+                or elapsed >= TELEGRAM_PROGRESS_HEARTBEAT):
+            send_telegram(
+                f"📊 Прогресс: <b>{progress}%</b> | ETA: {stats['eta']} | "
+                f"Скачано: {stats['done']:.2f}/{stats['total']:.2f} MB | "
+                f"Пиров: {stats['peers']}"
+            )
+            self.last_reported_percent = progress
+            self.last_progress_ts = now
+
+    def on_no_peers(self, timeout):
+        now = time.monotonic()
+        if now - self.last_no_peers_ts < TELEGRAM_PEERS_MIN_INTERVAL:
+            return
+        self.last_no_peers_ts = now
+        send_telegram(
+            f"⚠️ Нет пиров для загрузки <b>{self.name}</b> "
+            f"дольше {timeout} сек. Загрузка будет остановлена, если пиры не появятся."
+        )
+
+    def on_no_peers_timeout(self, timeout):
+        send_telegram(
+            f"⚠️ Нет пиров для загрузки <b>{self.name}</b> "
+            f"дольше {timeout} сек. Загрузка остановлена."
+        )
+
+    def on_peers_back(self, waited, stats):
+        now = time.monotonic()
+        if now - self.last_peers_back_ts < TELEGRAM_PEERS_MIN_INTERVAL:
+            return
+        self.last_peers_back_ts = now
+        send_telegram(
+            f"✅ Появились пиры для загрузки <b>{self.name}</b> спустя {waited} сек. "
+            f"Статус: <b>{stats['progress']}%</b> | ETA: {stats['eta']} | "
+            f"Скачано: {stats['done']:.2f}/{stats['total']:.2f} MB"
+        )
+
+    def on_interrupted(self):
+        send_telegram(
+            f"⛔️ Скачивание <b>{self.name}</b> остановлено пользователем (Ctrl+C)."
+        )
+
+    def on_complete(self, elapsed, average_speed_kb, files):
+        log_end = [
+            f"✅ <b>Загрузка завершена</b>",
+            f"<b>Имя:</b> {self.name}",
+            f"<b>Время:</b> {elapsed:.1f} сек",
+            f"<b>Средняя скорость:</b> {average_speed_kb:.2f} KB/s",
+            f"<b>Файлы:</b>",
+        ]
+        log_end.extend(f"• <code>{path}</code>" for path in files)
+        send_telegram("\n".join(log_end))
+
+    def on_error(self, exc):
+        send_telegram(
+            f"❌ Ошибка при загрузке: <b>{self.name}</b>\n"
+            f"Проблема: {type(exc).__name__}: {exc}\n\n<pre>{traceback.format_exc()}</pre>"
+        )
+
+
+def run(args, notifier):
+    """
+    Скачивает торрент по параметрам CLI/окружения, сообщая о событиях notifier.
+    Завершает процесс с кодом ошибки при неудаче.
+    """
     torrent_path = args.torrent or os.getenv("TORRENT_PATH")
     if not torrent_path:
         torrent_path = find_torrent_file()
@@ -129,13 +666,18 @@ def main():
             logging.shutdown()
             sys.exit(1)
 
-    if not torrent_path or not os.path.exists(torrent_path):
-        logging.error(f"Файл не найден: {torrent_path}")
-        sys.exit(1)
-
     save_path = args.save_dir or os.getenv("SAVE_PATH", "/app/downloads")
     port_start = args.port_start or int(os.getenv("LISTEN_PORT_START", "6881"))
     port_end = args.port_end or int(os.getenv("LISTEN_PORT_END", "6891"))
+    profile = args.profile or os.getenv("SETTINGS_PROFILE", "desktop")
+    if profile not in SETTINGS_PROFILES:
+        logging.error(f"Неизвестный профиль настроек: {profile}")
+        sys.exit(1)
+    default_disk_io = "posix" if os.path.exists("/.dockerenv") else "default"
+    disk_io = args.disk_io or os.getenv("DISK_IO", default_disk_io)
+    if disk_io not in DISK_IO_CONSTRUCTORS:
+        logging.error(f"Неизвестный режим дискового ввода-вывода: {disk_io}")
+        sys.exit(1)
 
     logging.info("Запуск загрузчика торрентов")
     logging.info(f"libtorrent version: {lt.version}")
@@ -144,6 +686,8 @@ def main():
     logging.info(f"LISTEN_PORT_START: {port_start}")
     logging.info(f"LISTEN_PORT_END: {port_end}")
     logging.info(f"NO_PEERS_TIMEOUT: {args.no_peers_timeout} секунд")
+    logging.info(f"SETTINGS_PROFILE: {profile}")
+    logging.info(f"DISK_IO: {disk_io}")
 
     try:
         os.makedirs(save_path, exist_ok=True)
@@ -152,12 +696,20 @@ def main():
         sys.exit(1)
 
     try:
+        # Торрент читаем до создания сессии: при ошибке не открываем порты зря
+        logging.info(f"Чтение .torrent файла: {torrent_path}")
+        try:
+            info = lt.torrent_info(torrent_path)
+        except RuntimeError as e:
+            msg = str(e).lower()
+            if "invalid" in msg or "bencod" in msg:
+                notifier.on_error(e)
+                sys.exit(2)
+            raise
+
         logging.info("Инициализация libtorrent...")
-        ses = lt.session()
-        ses.apply_settings({"listen_interfaces": f"0.0.0.0:{port_start}-{port_end}"})
+        ses = create_session(build_settings(profile, port_start, port_end), disk_io)
 
-        logging.info(f"Чтение .torrent файла: {torrent_path}")
-        info = lt.torrent_info(torrent_path)
         params = {
             "save_path": save_path,
             "storage_mode": lt.storage_mode_t(2),
@@ -167,158 +719,132 @@ def main():
         logging.info("Добавление торрента в сессию...")
         h = ses.add_torrent(params)
 
-        torrent_name = get_torrent_name(h)
-        logging.info(f"Скачивание файла: {torrent_name}")
-
-        log_start = [
-            f"🧲 <b>Старт загрузки</b>",
-            f"<b>Имя:</b> {torrent_name}",
-            f"<b>Путь к .torrent:</b> <code>{torrent_path}</code>",
-            f"<b>Сохраняем в:</b> <code>{save_path}</code>",
-            f"<b>Порты:</b> {port_start}-{port_end}",
-            f"<b>Размер:</b> {info.total_size() / (1024*1024):.2f} MB",
-            f"<b>libtorrent:</b> {lt.version}",
-        ]
-        send_telegram('\n'.join(log_start))
+        # total_wanted, в отличие от info.total_size(), не включает pad-файлы (BEP 47)
+        s = h.status()
+        total_bytes = s.total_wanted
+        total_mb = total_bytes / (1024 * 1024)
+        notifier.on_start(get_torrent_name(h), torrent_path, save_path, port_start, port_end, total_mb)
 
         last_progress = -1
-        last_reported_percent = 0
+        last_draw = 0.0
         start_time = time.time()
         no_peers_time = 0
+        no_peers_since = None
         no_peers_timer_active = False
 
+        # Основной цикл управляется очередью алертов libtorrent: статус
+        # запрашивается через post_torrent_updates() только при событиях
+        # (пиры, завершённые куски) или по heartbeat, а не каждую секунду.
+        status_changed = True
+        pending_update = False
+        finished = False
+        last_update = time.monotonic()
+
         try:
             while True:
-                s = h.status()
-                progress = int(s.progress * 100)
+                now = time.monotonic()
+                if status_changed:
+                    # Свойства статуса — вызовы в C++, читаем каждое один раз
+                    dl_rate = s.download_rate
+                    done = s.total_done
+                    num_peers = s.num_peers
+                    progress = int(s.progress * 100)
+
+                # Перерисовываем строку только при изменении прогресса или раз в секунду
+                if status_changed and (progress != last_progress or now - last_draw >= 1.0):
+                    downloaded = done / (1024 * 1024)
+                    speed = dl_rate / 1024  # KB/s
+                    eta_str = _fmt_eta((total_bytes - done) / dl_rate) if dl_rate > 0 else "—"
+
+                    stats = {
+                        "progress": progress,
+                        "done": downloaded,
+                        "total": total_mb,
+                        "speed": speed,
+                        "eta": eta_str,
+                        "peers": num_peers,
+                    }
+                    notifier.on_progress(stats)
+                    last_draw = now
+                    last_progress = progress
+
+                if finished:
+                    break
 
-                if s.num_peers == 0:
-                    no_peers_time += 1
+                if num_peers == 0:
+                    if no_peers_since is None:
+                        no_peers_since = now
+                    no_peers_time = int(now - no_peers_since)
                     if not no_peers_timer_active:
-                        print()
-                        logging.warning("Нет подключённых пиров. Запущен таймер автоостановки по отсутствию пиров.")
-                        send_telegram(
-                            f"⚠️ Нет пиров для загрузки <b>{torrent_name}</b> "
-                            f"дольше {args.no_peers_timeout} сек. Загрузка будет остановлена, если пиры не появятся."
-                        )
+                        notifier.on_no_peers(args.no_peers_timeout)
                         no_peers_timer_active = True
-                    if no_peers_time >= args.no_peers_timeout:
-                        logging.error(f"Пиров нет {args.no_peers_timeout} секунд подряд. Загрузка прервана.")
-                        send_telegram(
-                            f"⚠️ Нет пиров для загрузки <b>{torrent_name}</b> "
-                            f"дольше {args.no_peers_timeout} сек. Загрузка остановлена."
-                        )
-                        print()
+                    if now - no_peers_since >= args.no_peers_timeout:
+                        notifier.on_no_peers_timeout(args.no_peers_timeout)
                         sys.exit(5)
                 else:
                     if no_peers_timer_active:
-                        print()
-                        downloaded = s.total_done / (1024 * 1024)
-                        total = s.total_wanted / (1024 * 1024)
-                        speed = s.download_rate / 1024
-                        if s.download_rate > 0:
-                            eta_seconds = int((s.total_wanted - s.total_done) / s.download_rate)
-                            if eta_seconds > 3600:
-                                eta_str = f"{eta_seconds // 3600}ч {(eta_seconds % 3600) // 60}м"
-                            elif eta_seconds > 60:
-                                eta_str = f"{eta_seconds // 60}м {eta_seconds % 60}с"
-                            else:
-                                eta_str = f"{eta_seconds}с"
-                        else:
-                            eta_str = "—"
-                        logging.info(f"Появились пиры спустя {no_peers_time} секунд ожидания. Сбрасываем таймер.")
-                        send_telegram(
-                            f"✅ Появились пиры для загрузки <b>{torrent_name}</b> спустя {no_peers_time} сек. "
-                            f"Статус: <b>{progress}%</b> | ETA: {eta_str} | "
-                            f"Скачано: {downloaded:.2f}/{total:.2f} MB"
-                        )
+                        notifier.on_peers_back(no_peers_time, stats)
                         no_peers_timer_active = False
+                    no_peers_since = None
                     no_peers_time = 0
 
-                # Отправка прогресса только если есть скорость скачивания > 0
-                downloaded = s.total_done / (1024 * 1024)
-                total = s.total_wanted / (1024 * 1024)
-                speed = s.download_rate / 1024  # KB/s
-                if s.download_rate > 0:
-                    if s.download_rate > 0:
-                        eta_seconds = int((s.total_wanted - s.total_done) / s.download_rate)
-                        if eta_seconds > 3600:
-                            eta_str = f"{eta_seconds // 3600}ч {(eta_seconds % 3600) // 60}м"
-                        elif eta_seconds > 60:
-                            eta_str = f"{eta_seconds // 60}м {eta_seconds % 60}с"
-                        else:
-                            eta_str = f"{eta_seconds}с"
-                    else:
-                        eta_str = "—"
+                # Ждём алерта; если есть непрочитанные события — не дольше,
+                # чем до следующего разрешённого запроса статуса.
+                if pending_update:
+                    timeout = last_update + STATUS_UPDATE_INTERVAL - now
                 else:
-                    eta_str = "—"
-
-                sys.stdout.write(
-                    f"\rПрогресс: {progress}% | "
-                    f"Скачано: {downloaded:.2f}/{total:.2f} MB | "
-                    f"Скорость: {speed:.2f} KB/s | "
-                    f"ETA: {eta_str} | "
-                    f"Пиров: {s.num_peers}   "
-                )
-                sys.stdout.flush()
-
-                # Отправка прогресса каждые report_step% только если есть скорость
-                if (progress // report_step > last_reported_percent // report_step and 
-                        progress != 100 and s.download_rate > 0):
-                    send_telegram(
-                        f"📊 Прогресс: <b>{progress}%</b> | ETA: {eta_str} | "
-                        f"Скачано: {downloaded:.2f}/{total:.2f} MB | "
-                        f"Пиров: {s.num_peers}"
-                    )
-                    last_reported_percent = progress
-                last_progress = progress
-
-                if s.state == lt.torrent_status.seeding:
-                    break
-                time.sleep(1)
+                    timeout = last_update + STATUS_HEARTBEAT - now
+                # Пока пиров нет — просыпаемся не позже срока автоостановки
+                if no_peers_since is not None:
+                    timeout = min(timeout, no_peers_since + args.no_peers_timeout - now)
+                if timeout > 0:
+                    ses.wait_for_alert(math.ceil(timeout * 1000))
+
+                status_changed = False
+                for a in ses.pop_alerts():
+                    if isinstance(a, lt.state_update_alert):
+                        if a.status:
+                            s = a.status[0]
+                            status_changed = True
+                    elif isinstance(a, lt.torrent_finished_alert):
+                        finished = True
+                    elif isinstance(a, (lt.piece_finished_alert,
+                                        lt.peer_connect_alert,
+                                        lt.peer_disconnected_alert)):
+                        pending_update = True
+
+                now = time.monotonic()
+                if finished:
+                    s = h.status()
+                    status_changed = True
+                elif ((pending_update and now - last_update >= STATUS_UPDATE_INTERVAL)
+                        or now - last_update >= STATUS_HEARTBEAT):
+                    ses.post_torrent_updates()
+                    last_update = now
+                    pending_update = False
         except KeyboardInterrupt:
-            logging.warning("Операция скачивания прервана пользователем (Ctrl+C).")
-            send_telegram(
-                f"⛔️ Скачивание <b>{torrent_name}</b> остановлено пользователем (Ctrl+C)."
-            )
+            notifier.on_interrupted()
             sys.exit(4)
 
         elapsed = time.time() - start_time
-        print()
-        logging.info("Скачивание завершено!")
+        average_speed_kb = total_mb * 1024 / elapsed if elapsed > 0 else 0
+        notifier.on_complete(elapsed, average_speed_kb, torrent_files(info, save_path))
 
-        try:
-            total = s.total_wanted / (1024 * 1024)
-            average_speed_mb = total / elapsed if elapsed > 0 else 0
-            average_speed_kb = average_speed_mb * 1024
-            logging.info(f"Средняя скорость за сессию: {average_speed_kb:.2f} KB/s")
-        except Exception as e:
-            average_speed_kb = 0
-            logging.warning(f"Не удалось вычислить среднюю скорость: {e}")
+    except Exception as e:
+        notifier.on_error(e)
+        sys.exit(3)
 
-        log_end = [
-            f"✅ <b>Загрузка завершена</b>",
-            f"<b>Имя:</b> {torrent_name}",
-            f"<b>Время:</b> {elapsed:.1f} сек",
-            f"<b>Средняя скорость:</b> {average_speed_kb:.2f} KB/s",
-            f"<b>Файлы:</b>",
-        ]
-        for root, dirs, files in os.walk(save_path):
-            for file in files:
-                log_end.append(f"• <code>{os.path.join(root, file)}</code>")
 
-        send_telegram('\n'.join(log_end))
-        logging.info(f"Общее время скачивания: {elapsed:.1f} сек.")
+def main():
+    load_dotenv()
+    args = parse_args()
+    setup_logging(verbose=args.verbose, logfile=args.logfile)
 
-    except Exception as e:
-        msg = str(e).lower()
-        logging.error(f"{type(e).__name__}: {e}")
-        logging.error(traceback.format_exc())
-        send_telegram(
-            f"❌ Ошибка при загрузке: <b>{locals().get('torrent_name', 'N/A')}</b>\n"
-            f"Проблема: {type(e).__name__}: {e}\n\n<pre>{traceback.format_exc()}</pre>"
-        )
-        sys.exit(3)
+    notifiers = [ConsoleNotifier(), LogNotifier()]
+    if os.getenv("TELEGRAM_BOT_TOKEN"):
+        start_telegram()
+        notifiers.append(TelegramNotifier())
+    run(args, CompositeNotifier(notifiers))
 
 
 if __name__ == "__main__":